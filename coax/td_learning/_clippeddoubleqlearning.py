@@ -23,12 +23,14 @@ import warnings
 
 import jax
 import jax.numpy as jnp
+import numpy as onp
 import haiku as hk
+import chex
 import optax
 from gym.spaces import Discrete
 
 from .._core.q import Q
-from ..utils import get_grads_diagnostics, is_policy, is_stochastic
+from ..utils import docstring, get_grads_diagnostics, is_policy, is_stochastic, stack_trees
 from ._base import BaseTDLearning
 
 
@@ -75,11 +77,19 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
     pi_targ_list : list of Policy, optional
 
         The list of policies that are used for constructing the TD-target. This is ignored if the
-        action space is discrete and *required* otherwise.
+        action space is discrete and *required* otherwise. The policies are evaluated as a single
+        vectorized ensemble, which means that they must all share the same structure, the same
+        observation preprocessor and the same :code:`proba_dist`. Note that only the forward-pass
+        function of the **first** policy in this list is used; the other policies only contribute
+        their params and function state.
 
     q_targ_list : list of Q
 
-        The list of q-functions that are used for constructing the TD-target.
+        The list of q-functions that are used for constructing the TD-target. The q-functions are
+        evaluated as a single vectorized ensemble, which means that they must all share the same
+        structure, the same preprocessors and the same value transform. Note that only the
+        forward-pass function of the **first** q-function in this list is used; the other
+        q-functions only contribute their params and function state.
 
     optimizer : optax optimizer, optional
 
@@ -112,10 +122,23 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
         Note that the coefficient :math:`\beta` plays the role of the temperature in SAC-style
         agents.
 
+    target_dtype : dtype, optional
+
+        If provided, the forward passes of the target networks (which are never differentiated)
+        are done in this lower precision, e.g. ``jnp.bfloat16``. The outputs are cast back to the
+        dtype of the model params before taking the min and constructing the TD-target. This
+        roughly halves the memory traffic of the target networks, at the cost of less precise
+        TD-targets.
+
+    Note
+    ----
+    Compiling the update functions can take a while. Use :func:`coax.utils.enable_compilation_cache`
+    to reuse the compiled functions across processes.
+
     """
     def __init__(
             self, q, pi_targ_list=None, q_targ_list=None,
-            optimizer=None, loss_function=None, policy_regularizer=None):
+            optimizer=None, loss_function=None, policy_regularizer=None, target_dtype=None):
 
         if is_stochastic(q):
             raise NotImplementedError(f"{type(self).__name__} is not yet implement for StochasticQ")
@@ -131,6 +154,13 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
         del self._f_targ  # no need for this (only potential source of confusion)
         self.q_targ_list = q_targ_list
         self.pi_targ_list = [] if pi_targ_list is None else pi_targ_list
+        self._target_dtype = target_dtype
+        self._target_cache = {}
+
+        # stacking (and casting) the target ensembles in a single compiled function means that a
+        # rebuild, e.g. after a soft update of the target networks, costs a single dispatch
+        self._stack_targets_func = jax.jit(
+            lambda *trees: self._to_target_dtype(stack_trees(*trees)))
 
         # consistency check
         if isinstance(self.q.action_space, Discrete):
@@ -139,35 +169,41 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
         elif len(self.q_targ_list) * len(self.pi_targ_list) < 2:
             raise ValueError("len(q_targ_list) * len(pi_targ_list) must be at least 2")
 
+        # specialize on the action space once, instead of branching in every call to target_func;
+        # we also record the number of random keys that are split off in a single call
+        num_q_targ = len(self.q_targ_list)
+        if isinstance(self.q.action_space, Discrete):
+            self._min_q_sa_next = self._min_q_sa_next_discrete
+            self._num_a_next = num_q_targ
+            self._num_target_rngs = 1 + num_q_targ
+        else:
+            self._min_q_sa_next = self._min_q_sa_next_continuous
+            self._num_a_next = len(self.pi_targ_list)
+            self._num_target_rngs = 2 + self._num_a_next * (1 + num_q_targ)
+
         def loss_func(params, target_params, state, target_state, rng, transition_batch):
-            rngs = hk.PRNGSequence(rng)
-            S, A = transition_batch[:2]
-            S = self.q.observation_preprocessor(next(rngs), S)
-            A = self.q.action_preprocessor(next(rngs), A)
-            G = self.target_func(target_params, target_state, next(rngs), transition_batch)
-            Q, state_new = self.q.function_type1(params, state, next(rngs), S, A, True)
+            rngs = jax.random.split(rng, 4 + num_q_targ)
+            S = self.q.observation_preprocessor(rngs[0], transition_batch.S)
+            A = self.q.action_preprocessor(rngs[1], transition_batch.A)
+            G = self.target_func(target_params, target_state, rngs[2], transition_batch)
+            Q, state_new = self.q.function_type1(params, state, rngs[3], S, A, True)
             loss = self.loss_function(G, Q)
-            return loss, (loss, G, Q, S, A, state_new)
+            td_error = -jax.grad(self.loss_function, argnums=1)(G, Q)
 
-        def grads_and_metrics_func(
-                params, target_params, state, target_state, rng, transition_batch):
+            # target-network estimate (only needed for metrics, no gradients flow through here)
+            Q_targ = self._min_q_targ(
+                target_params['q_targ'], target_state['q_targ'], rngs[4:], S, A)
+            Q_targ = jax.lax.stop_gradient(Q_targ)
 
-            rngs = hk.PRNGSequence(rng)
-            grads, (loss, G, Q, S, A, state_new) = jax.grad(loss_func, has_aux=True)(
-                params, target_params, state, target_state, next(rngs), transition_batch)
+            return loss, (loss, td_error, G, Q, Q_targ, state_new)
 
-            # target-network estimate
-            Q_targ_list = []
-            qs = list(zip(self.q_targ_list, target_params['q_targ'], target_state['q_targ']))
-            for q, pm, st in qs:
-                Q_targ, _ = q.function_type1(pm, st, next(rngs), S, A, False)
-                assert Q_targ.ndim == 1, f"bad shape: {Q_targ.shape}"
-                Q_targ_list.append(Q_targ)
+        def grads_and_metrics_func(
+                params, target_params, state, target_state, rng, transition_batch):
 
-            # get min target estimate
-            Q_targ_list = jnp.stack(Q_targ_list, axis=-1)
-            assert Q_targ_list.ndim == 2, f"bad shape: {Q_targ_list.shape}"
-            Q_targ = jnp.min(Q_targ_list, axis=-1)
+            # single pass for both the gradients and the target-network estimates
+            grads, (loss, td_error, G, Q, Q_targ, state_new) = \
+                jax.grad(loss_func, has_aux=True)(
+                    params, target_params, state, target_state, rng, transition_batch)
 
             # residuals: estimate - better_estimate
             err = Q - G
@@ -184,14 +220,14 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
             # add some diagnostics of the gradients
             metrics.update(get_grads_diagnostics(grads, key_prefix=f'{name}/grads_'))
 
-            return grads, state_new, metrics
+            return grads, state_new, metrics, td_error
 
         def td_error_func(params, target_params, state, target_state, rng, transition_batch):
-            rngs = hk.PRNGSequence(rng)
-            S = self.q.observation_preprocessor(next(rngs), transition_batch.S)
-            A = self.q.action_preprocessor(next(rngs), transition_batch.A)
-            G = self.target_func(target_params, target_state, next(rngs), transition_batch)
-            Q, _ = self.q.function_type1(params, state, next(rngs), S, A, False)
+            rngs = jax.random.split(rng, 4)
+            S = self.q.observation_preprocessor(rngs[0], transition_batch.S)
+            A = self.q.action_preprocessor(rngs[1], transition_batch.A)
+            G = self.target_func(target_params, target_state, rngs[2], transition_batch)
+            Q, _ = self.q.function_type1(params, state, rngs[3], S, A, False)
             dL_dQ = jax.grad(self.loss_function, argnums=1)
             return -dL_dQ(G, Q)
 
@@ -200,82 +236,251 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
             new_params = optax.apply_updates(params, updates)
             return new_opt_state, new_params
 
-        self._apply_grads_func = jax.jit(apply_grads_func, static_argnums=0)
+        # the caller replaces opt_state and params right away, so XLA may reuse their buffers; the
+        # grads are not donated, because update_from_grads is public and callers may reuse them
+        # note: buffer donation isn't implemented on CPU (it would only raise a warning)
+        donate_argnums = () if jax.devices()[0].platform == 'cpu' else (1, 2)
+        self._apply_grads_func = jax.jit(
+            apply_grads_func, static_argnums=0, donate_argnums=donate_argnums)
         self._grads_and_metrics_func = jax.jit(grads_and_metrics_func)
         self._td_error_func = jax.jit(td_error_func)
 
+        # keep the jitted functions around, in case they're replaced by AOT-compiled ones
+        self._jitted_funcs = {
+            '_grads_and_metrics_func': self._grads_and_metrics_func,
+            '_td_error_func': self._td_error_func}
+
+    def update(self, transition_batch, return_td_error=False):
+        r"""
+
+        Update the model parameters (weights) of the underlying function approximator.
+
+        Parameters
+        ----------
+        transition_batch : TransitionBatch
+
+            A batch of transitions.
+
+        return_td_error : bool, optional
+
+            Whether to also return the TD-errors, see :attr:`td_error`. These are computed in the
+            same pass as the gradients, i.e. before the model parameters are updated. This is
+            cheaper than calling :attr:`td_error` separately, e.g. when updating the priorities of
+            a :class:`PrioritizedReplayBuffer <coax.experience_replay.PrioritizedReplayBuffer>`.
+            Note that, unlike :attr:`td_error`, these TD-errors come from the forward pass in
+            training mode (``is_training=True``), so they may differ slightly if the function
+            approximator uses e.g. batch normalization or dropout.
+
+        Returns
+        -------
+        metrics : dict of scalar ndarrays
+
+            The structure of the metrics dict is ``{name: score}``.
+
+        td_error : ndarray, shape: [batch_size]
+
+            A batch of TD-errors. This is only returned if ``return_td_error=True``.
+
+        """
+        grads, function_state, metrics, td_error = \
+            self._grads_metrics_and_td_error(transition_batch)
+        if any(jnp.any(jnp.isnan(g)) for g in jax.tree_leaves(grads)):
+            raise RuntimeError(f"found nan's in grads: {grads}")
+        self.update_from_grads(grads, function_state)
+        return (metrics, td_error) if return_td_error else metrics
+
+    def compile_for(self, transition_batch):
+        r"""
+
+        Compile the functions that process a batch of transitions ahead of time. This avoids any
+        tracing and dispatch overhead on subsequent calls to :attr:`update`,
+        :attr:`grads_and_metrics` and :attr:`td_error`.
+
+        Note that the compiled functions only accept transition batches with the exact same shapes
+        and dtypes as the example batch. Call this method again to recompile for a different batch
+        size. If the installed version of jax doesn't support ahead-of-time compilation, this
+        merely warms up the jit cache for the given shapes and dtypes.
+
+        Parameters
+        ----------
+        transition_batch : TransitionBatch
+
+            An example batch of transitions. Only its shapes and dtypes are used.
+
+        """
+        args = (
+            self.q.params, self.target_params, self.q.function_state, self.target_function_state,
+            jax.random.PRNGKey(0), transition_batch)
+        for name, func in self._jitted_funcs.items():
+            if hasattr(func, 'lower'):
+                setattr(self, name, func.lower(*args).compile())
+            else:  # older versions of jax have no ahead-of-time api, so we just warm up the cache
+                func(*args)
+
+    @docstring(BaseTDLearning.grads_and_metrics)
+    def grads_and_metrics(self, transition_batch):
+        grads, function_state, metrics, _ = self._grads_metrics_and_td_error(transition_batch)
+        return grads, function_state, metrics
+
+    def _grads_metrics_and_td_error(self, transition_batch):
+        return self._grads_and_metrics_func(
+            self.q.params, self.target_params, self.q.function_state, self.target_function_state,
+            self.q.rng, transition_batch)
+
     @property
     def q(self):
         return self._f
 
     @property
     def target_params(self):
-        return hk.data_structures.to_immutable_dict({
-            'q': self.q.params,
-            'q_targ': [q.params for q in self.q_targ_list],
-            'pi_targ': [pi.params for pi in self.pi_targ_list]})
+        return self._get_target_tree('params')
 
     @property
     def target_function_state(self):
-        return hk.data_structures.to_immutable_dict({
-            'q': self.q.function_state,
-            'q_targ': [q.function_state for q in self.q_targ_list],
-            'pi_targ': [pi.function_state for pi in self.pi_targ_list]})
+        return self._get_target_tree('function_state')
+
+    def _get_target_tree(self, attr):
+        """ get target params/state, where the q_targ and pi_targ ensembles are pre-stacked """
+        # note: the params/state of self.q are left out, because they're replaced on every update
+        # and they are passed to the compiled functions separately anyway
+        q_targ = self._cached(
+            ('q_targ', attr), *(getattr(q, attr) for q in self.q_targ_list),
+            build=self._stack_targets_func)
+        pi_targ = self._cached(
+            ('pi_targ', attr), *(getattr(pi, attr) for pi in self.pi_targ_list),
+            build=lambda *trees: self._stack_targets_func(*trees) if trees else None)
+        return self._cached(
+            ('target', attr), q_targ, pi_targ,
+            build=lambda q_targ, pi_targ: hk.data_structures.to_immutable_dict({
+                'q_targ': q_targ, 'pi_targ': pi_targ}))
+
+    def _cached(self, key, *deps, build):
+        """ return build(*deps), which is only recomputed if any of the deps got replaced """
+        if key in self._target_cache:
+            cached_deps, value = self._target_cache[key]
+            if len(deps) == len(cached_deps) and all(a is b for a, b in zip(deps, cached_deps)):
+                return value
+        value = build(*deps)
+        self._target_cache[key] = (deps, value)
+        return value
 
     def target_func(self, target_params, target_state, rng, transition_batch):
-        rngs = hk.PRNGSequence(rng)
+        # note: self._min_q_sa_next is set in __init__, depending on the action space
+        Q_sa_next = self._min_q_sa_next(target_params, target_state, rng, transition_batch)
+        Q_sa_next = jax.lax.stop_gradient(Q_sa_next)
 
-        # collect list of q-values
-        if isinstance(self.q.action_space, Discrete):
-            Q_sa_next_list = []
-            qs = list(zip(self.q_targ_list, target_params['q_targ'], target_state['q_targ']))
-
-            # compute A_next from q_i
-            for q_i, params_i, state_i in qs:
-                S_next = q_i.observation_preprocessor(next(rngs), transition_batch.S_next)
-                Q_s_next, _ = q_i.function_type2(params_i, state_i, next(rngs), S_next, False)
-                assert Q_s_next.ndim == 2, f"bad shape: {Q_s_next.shape}"
-                A_next = (Q_s_next == Q_s_next.max(axis=1, keepdims=True)).astype(Q_s_next.dtype)
-                A_next /= A_next.sum(axis=1, keepdims=True)  # there may be ties
-
-                # evaluate on q_j
-                for q_j, params_j, state_j in qs:
-                    S_next = q_j.observation_preprocessor(next(rngs), transition_batch.S_next)
-                    Q_sa_next, _ = q_j.function_type1(
-                        params_j, state_j, next(rngs), S_next, A_next, False)
-                    assert Q_sa_next.ndim == 1, f"bad shape: {Q_sa_next.shape}"
-                    f_inv = q_j.value_transform.inverse_func
-                    Q_sa_next_list.append(f_inv(Q_sa_next))
-
-        else:
-            Q_sa_next_list = []
-            qs = list(zip(self.q_targ_list, target_params['q_targ'], target_state['q_targ']))
-            pis = list(zip(self.pi_targ_list, target_params['pi_targ'], target_state['pi_targ']))
-
-            # compute A_next from pi_i
-            for pi_i, params_i, state_i in pis:
-                S_next = pi_i.observation_preprocessor(next(rngs), transition_batch.S_next)
-                dist_params, _ = pi_i.function(params_i, state_i, next(rngs), S_next, False)
-                A_next = pi_i.proba_dist.mode(dist_params)  # greedy action
-
-                # evaluate on q_j
-                for q_j, params_j, state_j in qs:
-                    S_next = q_j.observation_preprocessor(next(rngs), transition_batch.S_next)
-                    Q_sa_next, _ = q_j.function_type1(
-                        params_j, state_j, next(rngs), S_next, A_next, False)
-                    assert Q_sa_next.ndim == 1, f"bad shape: {Q_sa_next.shape}"
-                    f_inv = q_j.value_transform.inverse_func
-                    Q_sa_next_list.append(f_inv(Q_sa_next))
-
-        # take the min to mitigate over-estimation
-        Q_sa_next_list = jnp.stack(Q_sa_next_list, axis=-1)
-        assert Q_sa_next_list.ndim == 2, f"bad shape: {Q_sa_next_list.shape}"
-        Q_sa_next = jnp.min(Q_sa_next_list, axis=-1)
-
-        assert Q_sa_next.ndim == 1, f"bad shape: {Q_sa_next.shape}"
+        chex.assert_rank(Q_sa_next, 1)
         f = self.q.value_transform.transform_func
         return f(transition_batch.Rn + transition_batch.In * Q_sa_next)
 
+    def _min_q_sa_next_discrete(self, target_params, target_state, rng, transition_batch):
+        """ compute min_{i,j} q_j(S_next, argmax_a q_i(S_next, a)) """
+        # a single split provides the keys for all target networks: [S_next, Q_s_next_i..]
+        rngs = jax.random.split(rng, self._num_target_rngs)
+
+        # all q_targ share the same structure, so they're stored as a single stacked ensemble
+        q = self.q_targ_list[0]
+        S_next = q.observation_preprocessor(rngs[0], transition_batch.S_next)
+        S_next = self._to_target_dtype(S_next)
+
+        def q_s_next(params_i, state_i, rng_i, S_next):
+            Q_s_next, _ = q.function_type2(params_i, state_i, rng_i, S_next, False)
+            chex.assert_rank(Q_s_next, 2)
+            return Q_s_next
+
+        # one pass over the ensemble gives us q_j(S_next, a) for all j and a, which is all we need
+        Q_s_next = jax.vmap(q_s_next, in_axes=(0, 0, 0, None))(
+            target_params['q_targ'], target_state['q_targ'], rngs[1:], S_next)
+        Q_s_next = self._from_target_dtype(Q_s_next)
+        chex.assert_rank(Q_s_next, 3)
+
+        # stack of greedy actions A_next_i, ties are broken deterministically (first max)
+        A_next = jnp.argmax(Q_s_next, axis=2)
+
+        # evaluate each A_next_i on each q_j and take the min to mitigate over-estimation; this is
+        # an exact gather, i.e. Q_sa_next[i, j, b] = Q_s_next[j, b, A_next[i, b]]
+        Q_sa_next = jnp.take_along_axis(
+            Q_s_next[None], A_next[:, None, :, None], axis=3)[..., 0]
+        chex.assert_rank(Q_sa_next, 3)
+        Q_sa_next = q.value_transform.inverse_func(Q_sa_next)
+        return jnp.min(Q_sa_next, axis=(0, 1))
+
+    def _min_q_sa_next_continuous(self, target_params, target_state, rng, transition_batch):
+        """ compute min_{i,j} q_j(S_next, A_next_i), where A_next_i is the mode of pi_i """
+        # a single split provides the keys for all target networks: [S_next, S_next_pi, A_next_i..,
+        # Q_sa_next_ij..], where i and j run over pi_targ and over q_targ, respectively
+        rngs = jax.random.split(rng, self._num_target_rngs)
+        rngs_i = rngs[2:(2 + self._num_a_next)]
+        rngs_ij = rngs[(2 + self._num_a_next):].reshape(self._num_a_next, len(self.q_targ_list), -1)
+
+        # stack of greedy actions A_next_i, computed in one pass over the pi_targ ensemble
+        pi = self.pi_targ_list[0]
+        S_next_pi = pi.observation_preprocessor(rngs[1], transition_batch.S_next)
+        S_next_pi = self._to_target_dtype(S_next_pi)
+
+        def greedy_action(params_i, state_i, rng_i, S_next):
+            dist_params, _ = pi.function(params_i, state_i, rng_i, S_next, False)
+            return pi.proba_dist.mode(dist_params)
+
+        A_next = jax.vmap(greedy_action, in_axes=(0, 0, 0, None))(
+            target_params['pi_targ'], target_state['pi_targ'], rngs_i, S_next_pi)
+
+        # all q_targ share the same structure, so they're stored as a single stacked ensemble
+        q = self.q_targ_list[0]
+        S_next = q.observation_preprocessor(rngs[0], transition_batch.S_next)
+
+        # evaluate each A_next_i on each q_j and take the min to mitigate over-estimation
+        def min_q_sa_next(A_next_i, rngs_j, q_params, q_state, S_next):
+            return self._min_q_targ(
+                q_params, q_state, rngs_j, S_next, A_next_i, apply_inverse_transform=True)
+
+        Q_sa_next = jax.vmap(min_q_sa_next, in_axes=(0, 0, None, None, None))(
+            A_next, rngs_ij, target_params['q_targ'], target_state['q_targ'], S_next)
+        chex.assert_rank(Q_sa_next, 2)
+        return jnp.min(Q_sa_next, axis=0)
+
+    def _min_q_targ(self, q_params, q_state, rngs, S, A, apply_inverse_transform=False):
+        """ compute min_j q_j(S, A) over all (stacked) q_targ, using a single compiled kernel """
+        q = self.q_targ_list[0]
+        S, A = self._to_target_dtype((S, A))
+
+        def q_sa(params_j, state_j, rng_j, S, A):
+            Q_sa, _ = q.function_type1(params_j, state_j, rng_j, S, A, False)
+            chex.assert_rank(Q_sa, 1)
+            Q_sa = self._from_target_dtype(Q_sa)
+            if apply_inverse_transform:
+                Q_sa = q.value_transform.inverse_func(Q_sa)
+            return Q_sa
+
+        # keep a running min as the carry, so that we never materialize all q_j(S, A); the carry
+        # has the shape and dtype of a single q_j(S, A), which we infer without evaluating it
+        member_shapes = jax.tree_map(
+            lambda x: jax.ShapeDtypeStruct(x.shape[1:], x.dtype), (q_params, q_state, rngs))
+        input_shapes = jax.tree_map(lambda x: jax.ShapeDtypeStruct(x.shape, x.dtype), (S, A))
+        Q_sa_shape = jax.eval_shape(q_sa, *member_shapes, *input_shapes)
+        Q_sa_min = jnp.full(Q_sa_shape.shape, jnp.inf, dtype=Q_sa_shape.dtype)
+
+        def body(Q_sa_min, xs):
+            params_j, state_j, rng_j = xs
+            return jnp.minimum(Q_sa_min, q_sa(params_j, state_j, rng_j, S, A)), None
+
+        Q_sa_min, _ = jax.lax.scan(body, Q_sa_min, (q_params, q_state, rngs))
+        return Q_sa_min
+
+    def _to_target_dtype(self, pytree):
+        """ cast the floating-point leaves of a pytree to target_dtype (if it was provided) """
+        if self._target_dtype is None:
+            return pytree
+        return jax.tree_map(
+            lambda x: x.astype(self._target_dtype) if jnp.issubdtype(x.dtype, jnp.floating) else x,
+            pytree)
+
+    def _from_target_dtype(self, x):
+        """ cast the output of a target network back to the dtype of the (un-cast) model params """
+        if self._target_dtype is None:
+            return x
+        return x.astype(jnp.result_type(*jax.tree_leaves(self.q_targ_list[0].params)))
+
     def _check_input_lists(self, pi_targ_list, q_targ_list):
         # check input: pi_targ_list
         if isinstance(self.q.action_space, Discrete):
@@ -293,6 +498,12 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
                 if not is_policy(pi_targ):
                     raise TypeError(
                         f"all pi_targ in pi_targ_list must be a policies, got: {type(pi_targ)}")
+            if not all(_same_structure(pi_targ_list[0], pi_targ) for pi_targ in pi_targ_list):
+                raise TypeError("all pi_targ in pi_targ_list must have the same structure")
+            if not all(_same_policy_io(pi_targ_list[0], pi_targ) for pi_targ in pi_targ_list):
+                raise TypeError(
+                    "all pi_targ in pi_targ_list must have the same observation_preprocessor and "
+                    "proba_dist")
 
         # check input: q_targ_list
         if not isinstance(q_targ_list, (tuple, list)):
@@ -302,3 +513,61 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
         for q_targ in q_targ_list:
             if not isinstance(q_targ, Q):
                 raise TypeError(f"all q_targ in q_targ_list must be a coax.Q, got: {type(q_targ)}")
+        if not all(_same_structure(q_targ_list[0], q_targ) for q_targ in q_targ_list):
+            raise TypeError("all q_targ in q_targ_list must have the same structure")
+        if not all(_same_q_io(q_targ_list[0], q_targ) for q_targ in q_targ_list):
+            raise TypeError(
+                "all q_targ in q_targ_list must have the same observation_preprocessor, "
+                "action_preprocessor and value_transform")
+
+
+def _same_structure(f, g):
+    """ check if two function approximators can be stacked into a single (vectorized) ensemble """
+    if getattr(f, 'modeltype', None) != getattr(g, 'modeltype', None):
+        return False
+    f_tree, g_tree = (f.params, f.function_state), (g.params, g.function_state)
+    if jax.tree_structure(f_tree) != jax.tree_structure(g_tree):
+        return False
+    return all(
+        x.shape == y.shape and x.dtype == y.dtype
+        for x, y in zip(jax.tree_leaves(f_tree), jax.tree_leaves(g_tree)))
+
+
+def _same_q_io(q1, q2):
+    """ check if two q-functions preprocess their inputs and transform their outputs alike """
+    return (
+        _same_func(q1.observation_preprocessor, q2.observation_preprocessor)
+        and _same_func(q1.action_preprocessor, q2.action_preprocessor)
+        and type(q1.value_transform) is type(q2.value_transform)
+        and _same_func(q1.value_transform.transform_func, q2.value_transform.transform_func)
+        and _same_func(q1.value_transform.inverse_func, q2.value_transform.inverse_func))
+
+
+def _same_policy_io(pi1, pi2):
+    """ check if two policies preprocess their inputs and postprocess their outputs alike """
+    return (
+        _same_func(pi1.observation_preprocessor, pi2.observation_preprocessor)
+        and type(pi1.proba_dist) is type(pi2.proba_dist)
+        and pi1.proba_dist.space == pi2.proba_dist.space)
+
+
+def _same_func(f, g):
+    """ check if two functions are equivalent, e.g. two closures created by the same factory """
+    if f is g:
+        return True
+    if getattr(f, '__code__', None) is None or f.__code__ is not getattr(g, '__code__', None):
+        return False
+    f_cells = [c.cell_contents for c in (f.__closure__ or ())]
+    g_cells = [c.cell_contents for c in (g.__closure__ or ())]
+    return len(f_cells) == len(g_cells) and all(map(_same_value, f_cells, g_cells))
+
+
+def _same_value(x, y):
+    if x is y:
+        return True
+    if callable(x) and callable(y) and hasattr(x, '__code__'):
+        return _same_func(x, y)
+    try:
+        return bool(onp.all(x == y))
+    except Exception:  # values that can't be compared are considered to be different
+        return False
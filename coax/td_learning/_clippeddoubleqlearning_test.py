@@ -20,13 +20,19 @@
 # ------------------------------------------------------------------------------------------------ #
 
 from copy import deepcopy
+from functools import partial
 
+import jax
+import jax.numpy as jnp
+import haiku as hk
+import numpy as onp
 from optax import sgd
 
 from .._base.test_case import TestCase
 from .._core.q import Q
 from .._core.policy import Policy
 from ..utils import get_transition_batch
+from ..value_transforms import LogTransform
 from ._clippeddoubleqlearning import ClippedDoubleQLearning
 
 
@@ -169,3 +175,240 @@ class TestClippedDoubleQLearning(TestCase):
         msg = r"len\(q_targ_list\) \* len\(pi_targ_list\) must be at least 2"
         with self.assertRaisesRegex(ValueError, msg):
             ClippedDoubleQLearning(q, pi_targ_list=[pi], q_targ_list=[q_targ], optimizer=sgd(1.0))
+
+    def test_q_targ_list_different_structure(self):
+        env = self.env_discrete
+
+        q = Q(self.func_q_type1, env)
+        q_targ1 = Q(self.func_q_type1, env)
+        q_targ2 = Q(self.func_q_type2, env)
+
+        msg = r"all q_targ in q_targ_list must have the same structure"
+        with self.assertRaisesRegex(TypeError, msg):
+            ClippedDoubleQLearning(q, q_targ_list=[q_targ1, q_targ2], optimizer=sgd(1.0))
+
+    def test_q_targ_list_different_value_transform(self):
+        env = self.env_discrete
+
+        q = Q(self.func_q_type1, env)
+        q_targ1 = Q(self.func_q_type1, env)
+        q_targ2 = Q(self.func_q_type1, env, value_transform=LogTransform())
+
+        msg = r"all q_targ in q_targ_list must have the same observation_preprocessor, "
+        with self.assertRaisesRegex(TypeError, msg):
+            ClippedDoubleQLearning(q, q_targ_list=[q_targ1, q_targ2], optimizer=sgd(1.0))
+
+    def test_target_params_cached(self):
+        env = self.env_discrete
+        func_q = self.func_q_type1
+        transition_batch = self.transition_discrete
+
+        q = Q(func_q, env)
+        q_targ1 = q.copy()
+        q_targ2 = q.copy()
+        updater = ClippedDoubleQLearning(q, q_targ_list=[q_targ1, q_targ2], optimizer=sgd(1.0))
+
+        # updating q doesn't affect the target networks, so the stacked ensemble is reused
+        target_params = updater.target_params
+        updater.update(transition_batch)
+        self.assertIs(updater.target_params, target_params)
+
+        # syncing a target network triggers a rebuild
+        q_targ1.soft_update(q, tau=0.5)
+        self.assertIsNot(updater.target_params, target_params)
+        self.assertPytreeNotEqual(target_params['q_targ'], updater.target_params['q_targ'])
+
+    def test_update_return_td_error(self):
+        env = self.env_discrete
+        transition_batch = get_transition_batch(env, batch_size=5, random_seed=42)
+
+        # no batch normalization, such that the training-mode and eval-mode passes agree
+        q = Q(_func_q_type1_no_batch_norm, env)
+        q_targ1 = Q(_func_q_type1_no_batch_norm, env, random_seed=11)
+        q_targ2 = Q(_func_q_type1_no_batch_norm, env, random_seed=13)
+        updater = ClippedDoubleQLearning(q, q_targ_list=[q_targ1, q_targ2], optimizer=sgd(1.0))
+
+        td_error_expected = updater.td_error(transition_batch)
+        metrics, td_error = updater.update(transition_batch, return_td_error=True)
+
+        self.assertIsInstance(metrics, dict)
+        self.assertArrayShape(td_error, (5,))
+        onp.testing.assert_allclose(td_error, td_error_expected, rtol=1e-5, atol=1e-5)
+
+    def test_update_boxspace_target_dtype(self):
+        env = self.env_boxspace
+        func_q = self.func_q_type1
+        func_pi = self.func_pi_boxspace
+        transition_batch = self.transition_boxspace
+
+        q = Q(func_q, env)
+        pi1 = Policy(func_pi, env)
+        pi2 = Policy(func_pi, env)
+        q_targ1 = q.copy()
+        q_targ2 = q.copy()
+        updater = ClippedDoubleQLearning(
+            q, pi_targ_list=[pi1, pi2], q_targ_list=[q_targ1, q_targ2], optimizer=sgd(1.0),
+            target_dtype=jnp.bfloat16)
+        updater_fp32 = ClippedDoubleQLearning(
+            q, pi_targ_list=[pi1, pi2], q_targ_list=[q_targ1, q_targ2], optimizer=sgd(1.0))
+
+        # the target networks are stored in low precision
+        for leaf in jax.tree_leaves(updater.target_params['q_targ']):
+            self.assertEqual(leaf.dtype, jnp.bfloat16)
+
+        # the TD-target is in full precision and close to the one computed in full precision
+        rng = jax.random.PRNGKey(13)
+        G = updater.target_func(
+            updater.target_params, updater.target_function_state, rng, transition_batch)
+        G_fp32 = updater_fp32.target_func(
+            updater_fp32.target_params, updater_fp32.target_function_state, rng, transition_batch)
+        self.assertEqual(G.dtype, jnp.float32)
+        onp.testing.assert_allclose(G, G_fp32, rtol=2e-2, atol=2e-2)
+
+        params = deepcopy(q.params)
+        metrics, td_error = updater.update(transition_batch, return_td_error=True)
+
+        self.assertPytreeNotEqual(params, q.params)
+        self.assertEqual(td_error.dtype, jnp.float32)
+
+    def test_compile_for(self):
+        env = self.env_discrete
+        func_q = self.func_q_type1
+        transition_batch = self.transition_discrete
+
+        q = Q(func_q, env)
+        q_targ1 = q.copy()
+        q_targ2 = q.copy()
+        updater = ClippedDoubleQLearning(q, q_targ_list=[q_targ1, q_targ2], optimizer=sgd(1.0))
+        updater.compile_for(transition_batch)
+
+        params = deepcopy(q.params)
+        updater.update(transition_batch)
+        td_error = updater.td_error(transition_batch)
+
+        self.assertPytreeNotEqual(params, q.params)
+        self.assertArrayShape(td_error, (1,))
+
+    def test_compile_for_without_aot(self):
+        env = self.env_discrete
+        func_q = self.func_q_type1
+        transition_batch = self.transition_discrete
+
+        q = Q(func_q, env)
+        q_targ1 = q.copy()
+        q_targ2 = q.copy()
+        updater = ClippedDoubleQLearning(q, q_targ_list=[q_targ1, q_targ2], optimizer=sgd(1.0))
+
+        # mimic older versions of jax, whose jitted functions have no .lower() method
+        updater._jitted_funcs = {k: partial(f) for k, f in updater._jitted_funcs.items()}
+        updater.compile_for(transition_batch)
+
+        params = deepcopy(q.params)
+        updater.update(transition_batch)
+        td_error = updater.td_error(transition_batch)
+
+        self.assertPytreeNotEqual(params, q.params)
+        self.assertArrayShape(td_error, (1,))
+
+    def test_target_func_discrete_type1(self):
+        env = self.env_discrete
+        func_q = self.func_q_type1
+        transition_batch = get_transition_batch(env, batch_size=5, random_seed=42)
+
+        q = Q(func_q, env)
+        q_targ_list = [Q(func_q, env, random_seed=seed) for seed in (11, 13, 17)]
+        updater = ClippedDoubleQLearning(q, q_targ_list=q_targ_list, optimizer=sgd(1.0))
+
+        G = updater.target_func(
+            updater.target_params, updater.target_function_state, jax.random.PRNGKey(7),
+            transition_batch)
+        G_expected = _brute_force_target_discrete(q_targ_list, transition_batch)
+        onp.testing.assert_allclose(G, G_expected, rtol=1e-5, atol=1e-5)
+
+    def test_target_func_discrete_type2(self):
+        env = self.env_discrete
+        func_q = self.func_q_type2
+        transition_batch = get_transition_batch(env, batch_size=5, random_seed=42)
+
+        q = Q(func_q, env, value_transform=LogTransform())
+        q_targ_list = [
+            Q(func_q, env, value_transform=LogTransform(), random_seed=seed) for seed in (11, 13)]
+        updater = ClippedDoubleQLearning(q, q_targ_list=q_targ_list, optimizer=sgd(1.0))
+
+        G = updater.target_func(
+            updater.target_params, updater.target_function_state, jax.random.PRNGKey(7),
+            transition_batch)
+        G_expected = _brute_force_target_discrete(q_targ_list, transition_batch)
+        onp.testing.assert_allclose(G, G_expected, rtol=1e-5, atol=1e-5)
+
+    def test_target_func_boxspace(self):
+        env = self.env_boxspace
+        func_q = self.func_q_type1
+        func_pi = self.func_pi_boxspace
+        transition_batch = get_transition_batch(env, batch_size=5, random_seed=42)
+
+        q = Q(func_q, env)
+        q_targ_list = [Q(func_q, env, random_seed=seed) for seed in (11, 13)]
+        pi_targ_list = [Policy(func_pi, env, random_seed=seed) for seed in (19, 23, 29)]
+        updater = ClippedDoubleQLearning(
+            q, pi_targ_list=pi_targ_list, q_targ_list=q_targ_list, optimizer=sgd(1.0))
+
+        G = updater.target_func(
+            updater.target_params, updater.target_function_state, jax.random.PRNGKey(7),
+            transition_batch)
+        G_expected = _brute_force_target_boxspace(q_targ_list, pi_targ_list, transition_batch)
+        onp.testing.assert_allclose(G, G_expected, rtol=1e-5, atol=1e-5)
+
+
+def _func_q_type1_no_batch_norm(S, A, is_training):
+    flatten = hk.Flatten()
+    seq = hk.Sequential((
+        hk.Linear(7), jnp.tanh,
+        hk.Linear(3), jnp.tanh,
+        hk.Linear(1), jnp.ravel,
+    ))
+    X = jnp.concatenate((flatten(S), flatten(A)), axis=-1)
+    return seq(X)
+
+
+def _brute_force_target_discrete(q_targ_list, transition_batch):
+    """ compute Rn + In * min_{i,j} q_j(S_next, argmax_a q_i(S_next, a)) one sample at a time """
+    q = q_targ_list[0]
+    S_next = q.observation_preprocessor(q.rng, transition_batch.S_next)
+    Q_s_next = [
+        onp.asarray(q_i.function_type2(q_i.params, q_i.function_state, q_i.rng, S_next, False)[0])
+        for q_i in q_targ_list]
+
+    Q_sa_next = []
+    for b in range(transition_batch.batch_size):
+        values = []
+        for Q_s_next_i in Q_s_next:
+            a = onp.argmax(Q_s_next_i[b])
+            for Q_s_next_j in Q_s_next:
+                values.append(q.value_transform.inverse_func(Q_s_next_j[b, a]))
+        Q_sa_next.append(min(values))
+
+    G = transition_batch.Rn + transition_batch.In * onp.asarray(Q_sa_next)
+    return q.value_transform.transform_func(G)
+
+
+def _brute_force_target_boxspace(q_targ_list, pi_targ_list, transition_batch):
+    """ compute Rn + In * min_{i,j} q_j(S_next, mode(pi_i(S_next))) one sample at a time """
+    q, pi = q_targ_list[0], pi_targ_list[0]
+    S_next = q.observation_preprocessor(q.rng, transition_batch.S_next)
+    S_next_pi = pi.observation_preprocessor(pi.rng, transition_batch.S_next)
+
+    Q_sa_next = onp.full(transition_batch.batch_size, onp.inf)
+    for pi_i in pi_targ_list:
+        dist_params, _ = pi_i.function(
+            pi_i.params, pi_i.function_state, pi_i.rng, S_next_pi, False)
+        A_next_i = pi_i.proba_dist.mode(dist_params)
+        for q_j in q_targ_list:
+            Q_sa_next_ij, _ = q_j.function_type1(
+                q_j.params, q_j.function_state, q_j.rng, S_next, A_next_i, False)
+            Q_sa_next_ij = onp.asarray(q.value_transform.inverse_func(Q_sa_next_ij))
+            for b in range(transition_batch.batch_size):
+                Q_sa_next[b] = min(Q_sa_next[b], Q_sa_next_ij[b])
+
+    G = transition_batch.Rn + transition_batch.In * Q_sa_next
+    return q.value_transform.transform_func(G)
@@ -46,6 +46,7 @@ Object Reference
     coax.utils.diff_transform_matrix
     coax.utils.docstring
     coax.utils.double_relu
+    coax.utils.enable_compilation_cache
     coax.utils.enable_logging
     coax.utils.generate_gif
     coax.utils.get_env_attr
@@ -67,6 +68,7 @@ Object Reference
     coax.utils.render_episode
     coax.utils.safe_sample
     coax.utils.single_to_batch
+    coax.utils.stack_trees
     coax.utils.tree_ravel
 
 
@@ -95,10 +97,12 @@ from ._array import (
     merge_dicts,
     safe_sample,
     single_to_batch,
+    stack_trees,
     tree_ravel,
 )
 from ._misc import (
     docstring,
+    enable_compilation_cache,
     enable_logging,
     generate_gif,
     get_env_attr,
@@ -129,6 +133,7 @@ __all__ = (
     'diff_transform_matrix',
     'docstring',
     'double_relu',
+    'enable_compilation_cache',
     'enable_logging',
     'generate_gif',
     'get_env_attr',
@@ -150,5 +155,6 @@ __all__ = (
     'render_episode',
     'safe_sample',
     'single_to_batch',
+    'stack_trees',
     'tree_ravel',
 )
@@ -49,6 +49,7 @@ __all__ = (
     'merge_dicts',
     'single_to_batch',
     'safe_sample',
+    'stack_trees',
     'tree_ravel',
 )
 
@@ -852,6 +853,30 @@ def single_to_batch(pytree):
     return jax.tree_map(lambda arr: jnp.expand_dims(arr, axis=0), pytree)
 
 
+def stack_trees(*trees):
+    r"""
+
+    Apply :func:`jnp.stack <jax.numpy.stack>` to the leaves of a collection of pytrees.
+
+    This is typically used to turn a list of models that share the same structure into a single
+    model with an extra leading (ensemble) axis, which can then be evaluated by :func:`jax.vmap`.
+
+    Parameters
+    ----------
+    trees : sequence of pytrees with ndarray leaves
+
+        The pytrees to stack. These must all have the same tree structure and leaf shapes.
+
+    Returns
+    -------
+    pytree : pytree with ndarray leaves
+
+        A single pytree whose leaves have an extra leading axis of size ``len(trees)``.
+
+    """
+    return jax.tree_multimap(lambda *leaves: jnp.stack(leaves, axis=0), *trees)
+
+
 def tree_ravel(pytree):
     r"""
 
@@ -26,7 +26,7 @@ import numpy as onp
 from haiku import PRNGSequence
 
 from .._base.test_case import TestCase
-from ._array import argmax, check_preprocessors, default_preprocessor
+from ._array import argmax, check_preprocessors, default_preprocessor, stack_trees
 from ..proba_dists import NormalDist
 
 
@@ -107,3 +107,14 @@ class TestArrayUtils(TestCase):
         self.assertArrayShape(default_preprocessor(dct)(next(rngs), dct.sample())['mbn'], (1, 11))
         self.assertArrayShape(default_preprocessor(dct)(next(rngs), dct.sample())['mds'][0], (1, 3))
         self.assertArrayShape(default_preprocessor(dct)(next(rngs), dct.sample())['mds'][1], (1, 5))
+
+    def test_stack_trees(self):
+        tree1 = {'a': jnp.zeros((3, 5)), 'b': (jnp.ones(2), jnp.zeros(()))}
+        tree2 = {'a': jnp.ones((3, 5)), 'b': (jnp.zeros(2), jnp.ones(()))}
+        stacked = stack_trees(tree1, tree2)
+
+        self.assertArrayShape(stacked['a'], (2, 3, 5))
+        self.assertArrayShape(stacked['b'][0], (2, 2))
+        self.assertArrayShape(stacked['b'][1], (2,))
+        self.assertArrayAlmostEqual(stacked['a'][1], tree2['a'])
+        self.assertArrayAlmostEqual(stacked['b'][1], [0, 1])
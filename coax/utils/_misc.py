@@ -22,9 +22,11 @@
 import os
 import time
 import logging
+import warnings
 from importlib import reload, import_module
 from types import ModuleType
 
+import jax
 import jax.numpy as jnp
 import numpy as onp
 from PIL import Image
@@ -32,6 +34,7 @@ from PIL import Image
 
 __all__ = (
     'docstring',
+    'enable_compilation_cache',
     'enable_logging',
     'generate_gif',
     'get_env_attr',
@@ -143,6 +146,37 @@ def enable_logging(name=None, level=logging.INFO, output_filepath=None, output_l
         logging.getLogger('').addHandler(fh)
 
 
+def enable_compilation_cache(path):
+    r"""
+
+    Enable JAX's persistent compilation cache.
+
+    This stores the compiled XLA graphs on disk, such that they can be reused across processes. This
+    can save a significant amount of time on short runs.
+
+    Parameters
+    ----------
+    path : str
+
+        The directory in which to store the compiled graphs. Note that anyone who can write to this
+        directory can inject code into your process, so avoid shared locations like ``/tmp``.
+
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    options = {
+        'jax_compilation_cache_dir': path,
+        'jax_persistent_cache_min_entry_size_bytes': 0,
+        'jax_persistent_cache_min_compile_time_secs': 0,
+    }
+    for name, value in options.items():
+        try:
+            jax.config.update(name, value)
+        except AttributeError:  # raised by jax.config.update for unrecognized options
+            warnings.warn(
+                f"option {name!r} is not supported by jax=={jax.__version__}; the persistent "
+                "compilation cache may not be (fully) enabled")
+
+
 def _reload(module, reload_all, reloaded, logger):
     if isinstance(module, ModuleType):
         module_name = module.__name__